@@ -1,86 +1,272 @@
 from fastmcp import FastMCP
-from sqlalchemy import create_engine, text
-from sqlalchemy import inspect
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
 from dotenv import load_dotenv
+from functools import lru_cache
 import os
-import re
-import json
+import orjson
+import time
+
+import sqlglot
+from sqlglot import exp
+
+# Optional accelerator: Hyperscan compiles the forbidden-keyword scan into a
+# SIMD-backed DFA. The validator falls back to pure-Python scanning without it.
+try:
+    import hyperscan
+except ImportError:
+    hyperscan = None
 
 load_dotenv()
 
+def _serialize_result(data) -> str:
+    """
+    Serialize tool results with orjson: several times faster than stdlib json
+    on large result sets and handles datetime/UUID/Decimal without custom
+    encoders (anything else falls back to str)
+    """
+    return orjson.dumps(data, default=str).decode()
+
+
 mcp = FastMCP(
-    name="Database Assistant"
+    name="Database Assistant",
+    tool_serializer=_serialize_result
 )
 
 import sys
 
+def _scan_statements(sql: str) -> list:
+    """
+    Strip comments and split on semicolons in one pass over the SQL.
+
+    Walks the string tracking quoted strings, quoted identifiers, line
+    comments and block comments, so '--' or ';' inside a string literal is
+    copied through instead of being treated as a comment or statement break
+    (which the old regex approach got wrong). Returns the list of stripped,
+    non-empty statements.
+    """
+    statements = []
+    buf = []
+    i = 0
+    n = len(sql)
+    while i < n:
+        # Jump to the next character that can change state, copying the
+        # span before it verbatim
+        candidates = [p for p in (sql.find(c, i) for c in "'\"-/;") if p != -1]
+        if not candidates:
+            buf.append(sql[i:])
+            break
+        j = min(candidates)
+        buf.append(sql[i:j])
+        char = sql[j]
+        if char == "'":
+            # String literal: copy through closing quote, honoring '' escapes
+            end = sql.find("'", j + 1)
+            while end != -1 and sql[end + 1:end + 2] == "'":
+                end = sql.find("'", end + 2)
+            end = n - 1 if end == -1 else end
+            buf.append(sql[j:end + 1])
+            i = end + 1
+        elif char == '"':
+            # Quoted identifier: copy through closing quote
+            end = sql.find('"', j + 1)
+            end = n - 1 if end == -1 else end
+            buf.append(sql[j:end + 1])
+            i = end + 1
+        elif char == '-' and sql[j + 1:j + 2] == '-':
+            # Line comment: skip to end of line, keeping the newline
+            end = sql.find('\n', j + 2)
+            i = n if end == -1 else end
+        elif char == '/' and sql[j + 1:j + 2] == '*':
+            # Block comment: skip past the closing */
+            end = sql.find('*/', j + 2)
+            i = n if end == -1 else end + 2
+        elif char == ';':
+            statement = ''.join(buf).strip()
+            if statement:
+                statements.append(statement)
+            buf = []
+            i = j + 1
+        else:
+            # Lone '-' or '/': ordinary operator character
+            buf.append(char)
+            i = j + 1
+    statement = ''.join(buf).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+# The allowed/forbidden keywords are short literals, so the validator scans
+# with str.find/str.startswith - tight C loops in CPython - rather than
+# entering the regex engine at all. All checks run against the uppercased
+# statement.
+_ALLOWED_PREFIXES = ("SELECT", "EXPLAIN", "DESCRIBE", "SHOW")
+
+_FORBIDDEN_KEYWORDS = (
+    "INSERT", "UPDATE", "DELETE", "DROP", "CREATE", "ALTER", "TRUNCATE",
+    "REPLACE", "GRANT", "REVOKE", "SET", "RESET", "CALL", "EXECUTE",
+)
+
+# Compile the forbidden keywords into one Hyperscan database at import; a
+# single scan then checks every keyword with word boundaries in one pass.
+# The scratch space is allocated once alongside it and reused across scans -
+# the validator runs synchronously on a single-threaded asyncio server, so
+# sharing one scratch is safe
+if hyperscan is not None:
+    _HS_FORBIDDEN_DB = hyperscan.Database()
+    _HS_FORBIDDEN_DB.compile(
+        expressions=[rb'\b(?:' + '|'.join(_FORBIDDEN_KEYWORDS).encode() + rb')\b'],
+        ids=[1],
+        flags=[hyperscan.HS_FLAG_CASELESS],
+    )
+    _HS_FORBIDDEN_SCRATCH = hyperscan.Scratch(_HS_FORBIDDEN_DB)
+else:
+    _HS_FORBIDDEN_DB = None
+    _HS_FORBIDDEN_SCRATCH = None
+
+
+def _is_word_boundary(text: str, index: int) -> bool:
+    """Check that the character at index (if any) cannot extend a keyword."""
+    char = text[index:index + 1]
+    return not (char.isalnum() or char == '_')
+
+
+def _has_keyword(statement_upper: str, keyword: str, start: int = 0) -> bool:
+    """Find keyword on word boundaries in an uppercased statement."""
+    index = statement_upper.find(keyword, start)
+    while index != -1:
+        if _is_word_boundary(statement_upper, index - 1) and \
+                _is_word_boundary(statement_upper, index + len(keyword)):
+            return True
+        index = statement_upper.find(keyword, index + 1)
+    return False
+
+
+def _contains_forbidden_keyword(statement_upper: str) -> bool:
+    """Check an uppercased statement for forbidden keywords on word boundaries."""
+    if _HS_FORBIDDEN_DB is not None:
+        matched = []
+        _HS_FORBIDDEN_DB.scan(
+            statement_upper.encode(),
+            match_event_handler=lambda *args: matched.append(1),
+            scratch=_HS_FORBIDDEN_SCRATCH,
+        )
+        if matched:
+            return True
+    else:
+        for keyword in _FORBIDDEN_KEYWORDS:
+            if _has_keyword(statement_upper, keyword):
+                return True
+    return False
+
+
+# AST node types for the sqlglot-based check: statements must parse to one of
+# the allowed roots and must not contain any write node anywhere in the tree.
+# Commands sqlglot cannot classify (exp.Command) are rejected outright.
+_ALLOWED_ROOTS = (exp.Select, exp.Union, exp.With, exp.Describe, exp.Show)
+_FORBIDDEN_NODES = (
+    exp.Insert, exp.Update, exp.Delete, exp.Drop, exp.Create, exp.Alter,
+    exp.Command,
+)
+
+
+def _is_allowed_statement(statement_upper: str) -> bool:
+    """Check whether an uppercased statement starts a read-only operation."""
+    for prefix in _ALLOWED_PREFIXES:
+        if statement_upper.startswith(prefix) and \
+                _is_word_boundary(statement_upper, len(prefix)):
+            return True
+    # WITH ... SELECT
+    if statement_upper.startswith("WITH") and \
+            _is_word_boundary(statement_upper, 4) and \
+            _has_keyword(statement_upper, "SELECT", 4):
+        return True
+    return False
+
+@lru_cache(maxsize=1024)
 def is_read_only_query(sql: str) -> bool:
     """
     Validate if a SQL query is read-only (safe to execute).
-    
+
+    Results are cached (bounded LRU) since LLM agents tend to reissue the
+    same handful of query templates; callers should pass stripped SQL so
+    cache keys normalize.
+
     :param sql: The SQL query to validate
     :return: True if the query is read-only, False otherwise
     """
-    # Remove comments and normalize whitespace
-    sql_clean = re.sub(r'--.*?$', '', sql, flags=re.MULTILINE)  # Remove line comments
-    sql_clean = re.sub(r'/\*.*?\*/', '', sql_clean, flags=re.DOTALL)  # Remove block comments
-    sql_clean = sql_clean.strip()
-    
-    # Split into statements (handle multiple statements)
-    statements = [stmt.strip() for stmt in sql_clean.split(';') if stmt.strip()]
-    
+    # Strip comments and split into statements in a single pass
+    statements = _scan_statements(sql)
+
     # If no statements after cleaning, it's safe (empty or comments only)
     if not statements:
         return True
-    
-    # Define allowed read-only statement types
-    read_only_patterns = [
-        r'^SELECT\b',
-        r'^WITH\b.*SELECT\b',
-        r'^EXPLAIN\b',
-        r'^DESCRIBE\b',
-        r'^SHOW\b',
-        r'^PRAGMA\b.*=\s*off$',  # Only allow PRAGMA statements that turn things off
-    ]
-    
-    # Define forbidden write operations
-    forbidden_patterns = [
-        r'\b(INSERT|UPDATE|DELETE|DROP|CREATE|ALTER|TRUNCATE|REPLACE)\b',
-        r'\b(GRANT|REVOKE|SET|RESET)\b',
-        r'\bCALL\b',
-        r'\bEXECUTE\b',
-        r'\bPRAGMA\b.*=\s*on$',  # Forbid PRAGMA statements that turn things on
-    ]
-    
+
+    # Fast path: the vast majority of queries are a single SELECT. Accept
+    # immediately when a plain substring scan finds no forbidden keyword at
+    # all; any hit (even a harmless one like a column named CREATED) falls
+    # through to the boundary-checked general path below.
+    if len(statements) == 1:
+        single_upper = statements[0].upper()
+        if single_upper.startswith("SELECT") and \
+                _is_word_boundary(single_upper, 6) and \
+                not any(kw in single_upper for kw in _FORBIDDEN_KEYWORDS):
+            return True
+
     for statement in statements:
         if not statement:
             continue
-            
+
         statement_upper = statement.upper()
-        
-        # Check if statement matches any forbidden pattern
-        for pattern in forbidden_patterns:
-            if re.search(pattern, statement_upper, re.IGNORECASE):
-                return False
-        
-        # Check if statement matches any allowed pattern
-        allowed = False
-        for pattern in read_only_patterns:
-            if re.search(pattern, statement_upper, re.IGNORECASE):
-                allowed = True
-                break
-        
-        if not allowed:
+
+        # Cheap scan first: an allowed prefix with no forbidden keyword
+        # anywhere cannot be a write, so skip parsing
+        if not _contains_forbidden_keyword(statement_upper) and \
+                _is_allowed_statement(statement_upper):
+            continue
+
+        # Otherwise parse to an AST and classify by node type. The scan has
+        # false positives (keywords inside string literals or identifiers)
+        # and false negatives (e.g. statements it has no keyword for); only
+        # the AST can tell a real write from a mention of one.
+        try:
+            trees = sqlglot.parse(statement, read="postgres")
+        except Exception:
             return False
-    
+
+        for tree in trees:
+            if tree is None:
+                return False
+            if not isinstance(tree, _ALLOWED_ROOTS):
+                return False
+            if any(isinstance(node, _FORBIDDEN_NODES) for node in tree.walk()):
+                return False
+
     return True
 
 # Database setup
 try:
     db_url = (
-        f"postgresql+psycopg2://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME')}"
+        f"postgresql+asyncpg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT', '5432')}/{os.getenv('DB_NAME')}"
+    )
+    # Async engine so concurrent tool calls overlap on DB I/O instead of
+    # serializing on one sync connection. Size the pool for concurrency and
+    # pre-ping so ask_db never gets handed a stale connection after the DB
+    # drops idle sessions
+    # Every connection opens with default_transaction_read_only=on, so
+    # PostgreSQL itself hard-rejects writes even if one slips past the
+    # client-side validator, which stays on as a cheap first-line filter
+    engine = create_async_engine(
+        db_url,
+        pool_size=10,
+        max_overflow=20,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        connect_args={
+            "server_settings": {"default_transaction_read_only": "on"}
+        },
     )
-    engine = create_engine(db_url)
 except Exception as e:
     print(f"Failed to create engine: {e}", file=sys.stderr)
     raise
@@ -96,102 +282,146 @@ def test_simple() -> str:
     """Test if basic tool works"""
     return "Simple test works"
 
+# The schema rarely changes during a server session, so cache the built
+# result and serve repeat get_schema calls from memory until the TTL expires
+_SCHEMA_CACHE = {"data": None, "ts": 0.0}
+_SCHEMA_CACHE_TTL = 300  # seconds
+
+
 @mcp.tool("get_schema")
-def get_schema() -> str:
+async def get_schema() -> str:
     """
-    Get database schema information as a formatted string
+    Get database schema information as compact JSON, mapping each table name
+    to its columns, primary key and foreign keys
     """
+    if _SCHEMA_CACHE["data"] is not None and \
+            time.monotonic() - _SCHEMA_CACHE["ts"] < _SCHEMA_CACHE_TTL:
+        return _SCHEMA_CACHE["data"]
+
     try:
-        with engine.connect() as conn:
+        async with engine.connect() as conn:
             # Get all table names
             table_query = """
-                SELECT table_name 
-                FROM information_schema.tables 
-                WHERE table_schema = 'public' 
+                SELECT table_name
+                FROM information_schema.tables
+                WHERE table_schema = 'public'
                 AND table_type = 'BASE TABLE'
                 ORDER BY table_name
             """
-            table_result = conn.execute(text(table_query)).fetchall()
-            
-            schema_text = "Database Schema:\n\n"
-            
+            table_result = (await conn.execute(text(table_query))).fetchall()
+
+            # Fetch columns, primary keys and foreign keys for all tables in
+            # three bulk queries instead of three round-trips per table, then
+            # group the rows by table name in Python
+            column_query = """
+                SELECT
+                    table_name,
+                    column_name,
+                    data_type,
+                    is_nullable,
+                    column_default
+                FROM information_schema.columns
+                WHERE table_schema = 'public'
+                ORDER BY table_name, ordinal_position
+            """
+            columns_by_table = {}
+            for table_name, *col_info in (await conn.execute(text(column_query))).fetchall():
+                columns_by_table.setdefault(table_name, []).append(col_info)
+
+            pk_query = """
+                SELECT tc.table_name, kcu.column_name
+                FROM information_schema.table_constraints tc
+                JOIN information_schema.key_column_usage kcu
+                ON tc.constraint_name = kcu.constraint_name
+                WHERE tc.table_schema = 'public'
+                AND tc.constraint_type = 'PRIMARY KEY'
+                ORDER BY tc.table_name, kcu.ordinal_position
+            """
+            pks_by_table = {}
+            for table_name, col_name in (await conn.execute(text(pk_query))).fetchall():
+                pks_by_table.setdefault(table_name, []).append(col_name)
+
+            fk_query = """
+                SELECT
+                    tc.table_name,
+                    kcu.column_name,
+                    ccu.table_name AS foreign_table_name,
+                    ccu.column_name AS foreign_column_name
+                FROM information_schema.table_constraints AS tc
+                JOIN information_schema.key_column_usage AS kcu
+                ON tc.constraint_name = kcu.constraint_name
+                JOIN information_schema.constraint_column_usage AS ccu
+                ON ccu.constraint_name = tc.constraint_name
+                WHERE tc.constraint_type = 'FOREIGN KEY'
+                AND tc.table_schema = 'public'
+            """
+            fks_by_table = {}
+            for table_name, *fk_info in (await conn.execute(text(fk_query))).fetchall():
+                fks_by_table.setdefault(table_name, []).append(fk_info)
+
+            # Build a structured dict and serialize it once; consumers are
+            # LLMs and tools, so skip the human-oriented text formatting
+            schema = {}
             for table_row in table_result:
                 table_name = table_row[0]
                 if table_name.startswith("django_"):
                     continue
-                
-                schema_text += f"Table: {table_name}\n"
-                schema_text += "-" * (len(table_name) + 7) + "\n"
-                
-                # Get column information
-                column_query = """
-                    SELECT 
-                        column_name,
-                        data_type,
-                        is_nullable,
-                        column_default
-                    FROM information_schema.columns 
-                    WHERE table_schema = 'public' 
-                    AND table_name = %s
-                    ORDER BY ordinal_position
-                """
-                column_result = conn.execute(text(column_query), (table_name,)).fetchall()
-                
-                for col_row in column_result:
-                    col_name, data_type, nullable, default = col_row
-                    nullable_str = "NULL" if nullable == "YES" else "NOT NULL"
-                    default_str = f" DEFAULT {default}" if default else ""
-                    schema_text += f"  {col_name}: {data_type} {nullable_str}{default_str}\n"
-                
-                # Get primary keys
-                pk_query = """
-                    SELECT column_name
-                    FROM information_schema.table_constraints tc
-                    JOIN information_schema.key_column_usage kcu
-                    ON tc.constraint_name = kcu.constraint_name
-                    WHERE tc.table_schema = 'public'
-                    AND tc.table_name = %s
-                    AND tc.constraint_type = 'PRIMARY KEY'
-                """
-                pk_result = conn.execute(text(pk_query), (table_name,)).fetchall()
-                if pk_result:
-                    pk_columns = [row[0] for row in pk_result]
-                    schema_text += f"  PRIMARY KEY: {', '.join(pk_columns)}\n"
-                
-                # Get foreign keys
-                fk_query = """
-                    SELECT 
-                        kcu.column_name,
-                        ccu.table_name AS foreign_table_name,
-                        ccu.column_name AS foreign_column_name
-                    FROM information_schema.table_constraints AS tc
-                    JOIN information_schema.key_column_usage AS kcu
-                    ON tc.constraint_name = kcu.constraint_name
-                    JOIN information_schema.constraint_column_usage AS ccu
-                    ON ccu.constraint_name = tc.constraint_name
-                    WHERE tc.constraint_type = 'FOREIGN KEY'
-                    AND tc.table_schema = 'public'
-                    AND tc.table_name = %s
-                """
-                fk_result = conn.execute(text(fk_query), (table_name,)).fetchall()
-                
-                for fk_row in fk_result:
-                    col_name, ref_table, ref_col = fk_row
-                    schema_text += f"  FOREIGN KEY: {col_name} -> {ref_table}.{ref_col}\n"
-                
-                schema_text += "\n"
-            
-            return schema_text
-    
+
+                schema[table_name] = {
+                    "columns": [
+                        {
+                            "name": col_name,
+                            "type": data_type,
+                            "nullable": nullable == "YES",
+                            "default": default,
+                        }
+                        for col_name, data_type, nullable, default
+                        in columns_by_table.get(table_name, [])
+                    ],
+                    "primary_key": pks_by_table.get(table_name, []),
+                    "foreign_keys": [
+                        {"column": col_name, "references": f"{ref_table}.{ref_col}"}
+                        for col_name, ref_table, ref_col
+                        in fks_by_table.get(table_name, [])
+                    ],
+                }
+
+            schema_json = _serialize_result(schema)
+            _SCHEMA_CACHE["data"] = schema_json
+            _SCHEMA_CACHE["ts"] = time.monotonic()
+            return schema_json
+
     except Exception as e:
         return f"Error getting schema: {str(e)}"
-        
-    except Exception as e:
-        return {"error": f"Failed to get schema: {str(e)}"}
+
+
+@mcp.tool("refresh_schema")
+def refresh_schema() -> str:
+    """
+    Invalidate the cached schema so the next get_schema call re-reads it
+    """
+    _SCHEMA_CACHE["data"] = None
+    _SCHEMA_CACHE["ts"] = 0.0
+    return "Schema cache invalidated"
+
+
+# Hard cap on rows returned by ask_db so a SELECT against a huge table
+# cannot exhaust server memory
+MAX_ROWS = 10000
+
+
+@lru_cache(maxsize=256)
+def _prep(sql: str):
+    """
+    Cache the TextClause built for a query so repeat SQL from agents skips
+    reconstructing it; the cached clause also keeps a stable cache key for
+    SQLAlchemy's compiled-SQL cache and asyncpg's prepared-statement cache
+    """
+    return text(sql)
 
 
 @mcp.tool("ask_db")
-def ask_db(sql: str) -> dict:
+async def ask_db(sql: str) -> dict:
     """
     The function `ask_db` executes a SQL query and returns the result in a dictionary format.
     Only read-only queries (SELECT, WITH, EXPLAIN, etc.) are allowed for security.
@@ -200,10 +430,11 @@ def ask_db(sql: str) -> dict:
     using an SQLAlchemy engine. The function then returns a dictionary containing the SQL query and the
     result of the query execution
     :type sql: str
-    :return: The function `ask_db` returns a dictionary with two keys: "sql" and "result". The "sql" key
-    contains the SQL query that was executed, and the "result" key contains the result of the query in a
-    nicely formatted list of dictionaries. If an error occurs during the SQL execution, the function
-    returns a dictionary with an "error" key containing the error message and the original
+    :return: The function `ask_db` returns a dictionary with keys "sql", "columns" and "rows". The
+    "sql" key contains the SQL query that was executed, "columns" the list of column names, and
+    "rows" the result rows as lists of values in column order. If an error occurs during the SQL
+    execution, the function returns a dictionary with an "error" key containing the error message
+    and the original SQL
     """
     sql = sql.strip()
     # Validate that the query is read-only
@@ -213,16 +444,35 @@ def ask_db(sql: str) -> dict:
             "sql": sql
         }
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text(sql)).fetchall()
-            result = [dict(row._mapping) for row in result]  # Format nicely
+        async with engine.connect() as conn:
+            # Stream rows through a server-side cursor instead of fetchall()
+            # so the result set never has to fit in memory at once
+            cursor = await conn.stream(
+                _prep(sql), execution_options={"yield_per": 1000}
+            )
+
+            # Column names are identical for every row, so send them once and
+            # return the rows as plain value lists instead of building one
+            # dict (re-hashing the same keys) per row
+            columns = list(cursor.keys())
+            rows = []
+            truncated = False
+            async for row in cursor:
+                rows.append(list(row))
+                if len(rows) >= MAX_ROWS:
+                    truncated = True
+                    break
     except Exception as e:
         return {"error": f"SQL execution failed: {str(e)}", "sql": sql}
 
-    return {
+    response = {
         "sql": sql,
-        "result": result
+        "columns": columns,
+        "rows": rows
     }
+    if truncated:
+        response["truncated"] = True
+    return response
 
 if __name__ == "__main__":
     # Run the MCP server